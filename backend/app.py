@@ -1,19 +1,29 @@
 # FILE: app.py
 
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import ORJSONResponse, FileResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import pandas as pd
+import orjson
 from dotenv import load_dotenv
 
 # --- NEW IMPORTS FOR PLOTTING ---
 import io
-import base64
+import os
+import re
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from functools import lru_cache
+import pybase64
 import matplotlib
 matplotlib.use('Agg') # Use a non-interactive backend for server environments
 import matplotlib.pyplot as plt
-from statsmodels.tsa.arima.model import ARIMA
+from matplotlib.figure import Figure
+import numpy as np
 
 # ---------------------------------
 
@@ -22,23 +32,54 @@ load_dotenv()
 
 # Import our custom modules
 from modules import data_handler, insights_generator, chart_generator, llm_handler, pdf_generator
+from modules.fast_arima import fit_arima111, forecast_arima111
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
-chat_history = []
+# Number of recent messages sent to the LLM as conversation context
+MAX_HISTORY = 10
+# Bounded so a long-running server keeps constant memory; old turns are evicted in O(1)
+chat_history = deque(maxlen=MAX_HISTORY * 2)
 
 # --- NEW HELPER FUNCTION FOR PLOTTING ---
-def plot_to_base64(plot_obj):
+# One reusable Figure per thread. It is created outside pyplot, so it never goes
+# through the global figure manager and is cleared rather than closed after each plot.
+_plot_canvas = threading.local()
+
+def get_plot_axes():
+    """Returns the Axes of this thread's reusable chat Figure."""
+    if not hasattr(_plot_canvas, "fig"):
+        _plot_canvas.fig = Figure(figsize=(8, 5), dpi=100)
+        _plot_canvas.ax = _plot_canvas.fig.add_subplot()
+    return _plot_canvas.ax
+
+def reset_plot_axes():
+    """Clears this thread's chat Figure and returns a fresh Axes, so nothing left by an earlier request leaks in."""
+    fig = get_plot_axes().get_figure()
+    fig.clf()
+    _plot_canvas.ax = fig.add_subplot()
+    return _plot_canvas.ax
+
+def plot_to_base64(plot_obj=None):
     """
-    Takes a Matplotlib Axes object, saves it to a buffer,
+    Takes a Matplotlib Axes object (defaults to the reusable chat Axes), saves it to a buffer,
     and returns a Base64 encoded string in a structured dictionary.
     """
-    fig = plot_obj.get_figure()
+    fig = plot_obj.get_figure() if plot_obj is not None else get_plot_axes().get_figure()
     buf = io.BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight')
-    plt.close(fig) # Close the figure to free up memory
-    buf.seek(0)
-    image_base64 = base64.b64encode(buf.read()).decode('utf-8')
+    # tight_layout() once instead of bbox_inches='tight' (which renders twice),
+    # and the fastest zlib level since PNG compression dominates the save time
+    fig.set_dpi(100)
+    fig.tight_layout()
+    fig.savefig(buf, format='png', dpi=100, pil_kwargs={'compress_level': 1})
+    if fig is getattr(_plot_canvas, "fig", None):
+        # Reset the shared Figure (drops any extra axes such as colorbars) for the next plot
+        fig.clf()
+        _plot_canvas.ax = fig.add_subplot()
+    else:
+        plt.close(fig) # Plot drawn on its own pyplot figure; close it to free up memory
+    # getvalue() avoids the seek/read copy; pybase64 uses SIMD encoding
+    image_base64 = pybase64.b64encode(buf.getvalue()).decode('ascii')
     buf.close()
     return {"type": "plot", "image": image_base64}
 # ------------------------------------------
@@ -48,6 +89,50 @@ def plot_to_base64(plot_obj):
 # ... (all other code and imports remain the same) ...
 
 # --- UPGRADED HELPER FUNCTION FOR FORECASTING ---
+class ForecastError(ValueError):
+    """Raised when the data is not suitable for fitting a forecast model."""
+
+
+def _fit_arima(df: pd.DataFrame, target_column: str, filters: dict = None):
+    """
+    Filters the dataframe, builds the monthly series and fits an ARIMA(1,1,1) model.
+    Returns the last observed month together with the fitted model state.
+    """
+    # --- NEW: Apply filters if they are provided ---
+    filters = filters or {}
+    for column in filters:
+        if column not in df.columns:
+            raise ForecastError(f"Cannot filter by '{column}' as it does not exist.")
+
+    # Work on the few columns we need and combine all filters into one mask instead of copying the frame
+    mask = np.ones(len(df), dtype=bool)
+    for column, value in filters.items():
+        mask &= df[column].eq(value).to_numpy(dtype=bool, na_value=False)
+    filtered_df = df.loc[mask, ['Month', target_column]]
+
+    if filtered_df.empty:
+        raise ForecastError(f"No data found for the specified filters {filters or None}.")
+    # --- END NEW ---
+
+    if not pd.api.types.is_datetime64_any_dtype(filtered_df['Month']):
+        raise ForecastError("Forecasting requires a datetime 'Month' column.")
+
+    time_series = filtered_df.groupby('Month')[target_column].sum().asfreq('MS')
+
+    if len(time_series) < 12:
+        raise ForecastError("Not enough historical data (at least 12 months required) to generate a reliable forecast for the given filters.")
+
+    state = fit_arima111(time_series.to_numpy(dtype=np.float64))
+    return time_series.index[-1], state
+
+
+@lru_cache(maxsize=64)
+def _fit_arima_cached(data_version: int, target_column: str, filters_key: frozenset = None):
+    """Fits against the stored dataset; data_version keys the cache so uploads invalidate it."""
+    filters = dict(filters_key) if filters_key else None
+    return _fit_arima(data_handler.get_dataframe(), target_column, filters)
+
+
 def get_forecast(df: pd.DataFrame, target_column: str = 'Sales', periods: int = 3, filters: dict = None):
     """
     Generates a forecast using a simple ARIMA model.
@@ -55,35 +140,15 @@ def get_forecast(df: pd.DataFrame, target_column: str = 'Sales', periods: int =
     Returns the forecast as a formatted string.
     """
     try:
-        # --- NEW: Apply filters if they are provided ---
-        filtered_df = df.copy()
-        if filters:
-            for column, value in filters.items():
-                if column not in filtered_df.columns:
-                    return f"Error: Cannot filter by '{column}' as it does not exist."
-                filtered_df = filtered_df[filtered_df[column] == value]
-        
-        if filtered_df.empty:
-            return f"Error: No data found for the specified filters {filters}."
-        # --- END NEW ---
-
-        if not pd.api.types.is_datetime64_any_dtype(filtered_df['Month']):
-            return "Error: Forecasting requires a datetime 'Month' column."
-            
-        time_series = filtered_df.groupby('Month')[target_column].sum().asfreq('MS')
-
-        if len(time_series) < 12:
-            return f"Error: Not enough historical data (at least 12 months required) to generate a reliable forecast for the given filters."
-        
-        # --- THIS IS THE LINE TO CHANGE ---
-        # OLD: model = ARIMA(time_series, order=(1, 1, 1), suppress_warnings=True)
-        # NEW: Remove the unsupported argument
-        model = ARIMA(time_series, order=(1, 1, 1))
-        # ------------------------------------
+        # Reuse a previously fitted model when forecasting on the uploaded dataset
+        if df is data_handler.df_storage.get('current'):
+            filters_key = frozenset(filters.items()) if filters else None
+            last_month, state = _fit_arima_cached(data_handler.DATA_VERSION, target_column, filters_key)
+        else:
+            last_month, state = _fit_arima(df, target_column, filters)
 
-        model_fit = model.fit()
-        
-        forecast_result = model_fit.forecast(steps=periods)
+        forecast_index = pd.date_range(last_month + pd.offsets.MonthBegin(1), periods=periods, freq='MS')
+        forecast_result = pd.Series(forecast_arima111(state, periods), index=forecast_index)
         
         forecast_df = forecast_result.reset_index()
         forecast_df.columns = ['Forecasted Month', f'Predicted {target_column}']
@@ -93,10 +158,49 @@ def get_forecast(df: pd.DataFrame, target_column: str = 'Sales', periods: int =
         filter_str = f" for {filters}" if filters else ""
         return f"Here is the forecast for the next {periods} months{filter_str}:\n\n{forecast_df.to_string(index=False)}"
 
+    except ForecastError as e:
+        return f"Error: {e}"
     except Exception as e:
         return f"Error: Failed to generate forecast. Details: {e}"
 # ----------------------------------------------
 
+# --- CHAT CODE EXECUTION ---
+# Stereotyped one-liners the LLM emits for the most common questions; these are
+# answered with a direct pandas call instead of going through compile/eval.
+_COLUMN_AGG_RE = re.compile(r"""^df\[(['"])(?P<col>[^'"]+)\1\]\.(?P<agg>sum|mean|median|min|max|count|nunique)\(\)$""")
+_GROUPBY_AGG_RE = re.compile(
+    r"""^df\.groupby\((['"])(?P<by>[^'"]+)\1\)\[(['"])(?P<col>[^'"]+)\3\]"""
+    r"""\.(?P<agg>sum|mean|median|min|max|count)\(\)(?:\.(?P<pick>idxmax|idxmin)\(\))?$"""
+)
+
+def _run_fast_path(code: str, df: pd.DataFrame):
+    """Returns (True, result) when the code matches a known intent, otherwise (False, None)."""
+    match = _COLUMN_AGG_RE.match(code)
+    if match:
+        return True, getattr(df[match['col']], match['agg'])()
+
+    match = _GROUPBY_AGG_RE.match(code)
+    if match:
+        result = getattr(df.groupby(match['by'])[match['col']], match['agg'])()
+        if match['pick']:
+            result = getattr(result, match['pick'])()
+        return True, result
+
+    return False, None
+
+@lru_cache(maxsize=256)
+def _compile_chat_code(code: str):
+    """Compiles LLM-generated code once; repeated questions reuse the code object."""
+    return compile(code, '<chat>', 'eval')
+
+def execute_chat_code(code: str, exec_globals: dict):
+    """Evaluates a single line of generated code against the execution environment."""
+    matched, result = _run_fast_path(code, exec_globals["df"])
+    if matched:
+        return result
+    return eval(_compile_chat_code(code), exec_globals)
+# ----------------------------------------------
+
 # ... (the rest of your app.py file remains unchanged) ...
 
 
@@ -108,6 +212,8 @@ async def startup_event():
         print("Preload successful: Data is ready.")
     except ValueError:
         print("No pre-existing data found. Waiting for upload.")
+    # Start one chart renderer now so the first PDF export doesn't wait on Chromium
+    pdf_generator.warm_up_renderers()
 
 app.add_middleware(
     CORSMiddleware,
@@ -117,27 +223,57 @@ app.add_middleware(
 class ChatRequest(BaseModel):
     message: str
 
+UPLOAD_CHUNK_SIZE = 1 << 20 # 1 MiB
+UPLOAD_SPOOL_MAX_SIZE = 16 << 20 # Keep uploads up to 16 MiB in memory
+PDF_WRITE_BUFFER_SIZE = 1 << 20 # Coalesce the PDF writer's many small writes into large ones
+
+# Derived results, reused until data_handler.DATA_VERSION changes (i.e. a new upload)
+_dashboard_cache = {"version": None, "payload": None}
+_pdf_cache = {"version": None, "path": None}
+
+async def get_dashboard_payload(df: pd.DataFrame, version: int) -> dict:
+    """Returns the KPIs, charts and AI summary for the dataframe, rebuilding them only when the data version changes."""
+    if _dashboard_cache["version"] == version:
+        return _dashboard_cache["payload"]
+
+    kpis = insights_generator.generate_kpis(df)
+    # Build the charts in a worker thread while the LLM summary request is in flight
+    charts, ai_summary = await asyncio.gather(
+        asyncio.to_thread(chart_generator.create_charts, df),
+        llm_handler.generate_ai_summary(df, kpis),
+    )
+    payload = {"kpis": kpis, "charts": charts, "summary": ai_summary}
+
+    # Don't pin a failed LLM call; retry it on the next request
+    if not ai_summary.startswith("Error generating summary"):
+        _dashboard_cache["version"] = version
+        _dashboard_cache["payload"] = payload
+    return payload
+
 @app.post("/api/upload")
 async def upload_data(file: UploadFile = File(...)):
-    # This endpoint is correct and remains unchanged from your old code
     try:
-        contents = await file.read()
-        data_handler.load_and_clean_data(contents, file.filename)
-        global chat_history
+        # Spool the upload in chunks (spilling to disk when large) instead of one big bytes object,
+        # then parse, clean and persist off the event loop so other requests keep being served
+        with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE) as tmp:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                tmp.write(chunk)
+            tmp.seek(0)
+            await asyncio.to_thread(data_handler.load_and_clean_data, tmp, file.filename)
         chat_history.clear()
-        return JSONResponse(content={"message": "File uploaded and processed successfully."})
+        return ORJSONResponse(content={"message": "File uploaded and processed successfully."})
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
 
 @app.get("/api/dashboard")
 async def get_dashboard_data():
-    # This endpoint is correct and remains unchanged from your old code
     try:
+        version = data_handler.DATA_VERSION
         df = data_handler.get_dataframe()
-        kpis = insights_generator.generate_kpis(df)
-        charts = chart_generator.create_charts(df)
-        ai_summary = llm_handler.generate_ai_summary(df, kpis)
-        return {"kpis": kpis, "charts": charts, "summary": ai_summary}
+        payload = await get_dashboard_payload(df, version)
+        # Charts are already JSON; embed them as-is rather than re-encoding them as escaped strings
+        charts = {key: orjson.Fragment(chart_json) for key, chart_json in payload["charts"].items()}
+        return ORJSONResponse({**payload, "charts": charts})
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -149,14 +285,11 @@ async def get_dashboard_data():
 async def chat_with_data(request: ChatRequest):
     try:
         df = data_handler.get_dataframe()
-        global chat_history
-
         chat_history.append({"role": "user", "content": request.message})
         
-        MAX_HISTORY = 10
-        recent_history = chat_history[-MAX_HISTORY:]
+        recent_history = list(chat_history)[-MAX_HISTORY:]
 
-        code_to_execute = llm_handler.generate_code_from_query(df, recent_history)
+        code_to_execute = await llm_handler.generate_code_from_query(df, recent_history)
         
         if code_to_execute.startswith("Error:"):
             chat_history.append({"role": "bot", "content": code_to_execute})
@@ -168,11 +301,15 @@ async def chat_with_data(request: ChatRequest):
             "pd": pd,
             "df": df,
             "plot_to_base64": plot_to_base64,
+            "ax": reset_plot_axes(), # Reusable Axes for chart requests, cleared for each request
             "get_forecast": get_forecast # Make the forecast function available
         }
         
         # Execute the code generated by the LLM
-        result = eval(code_to_execute, exec_globals)
+        result = execute_chat_code(code_to_execute.strip(), exec_globals)
+        # Only code that ran cleanly is cached for reuse (tools report failures as "Error: ..." strings)
+        if not (isinstance(result, str) and result.startswith("Error:")):
+            llm_handler.record_code_success(df, recent_history, code_to_execute)
         
         # Check if the result is a plot
         if isinstance(result, dict) and result.get("type") == "plot":
@@ -214,37 +351,50 @@ async def export_pdf_report():
 
         # Step 1: Load dataframe
         print("[DEBUG] Loading dataframe...", flush=True)
+        version = data_handler.DATA_VERSION
         df = data_handler.get_dataframe()
         print(f"[DEBUG] Dataframe shape: {df.shape}", flush=True)
         print(f"[DEBUG] Dataframe columns: {list(df.columns)}", flush=True)
 
-        # Step 2: Generate KPIs
-        print("[DEBUG] Generating KPIs...", flush=True)
-        kpis = insights_generator.generate_kpis(df)
-        print(f"[DEBUG] KPIs generated: {kpis}", flush=True)
+        pdf_headers = {"Content-Disposition": "attachment;filename=dashboard_report.pdf"}
+        if _pdf_cache["version"] == version:
+            print("[DEBUG] Reusing cached PDF for this data version", flush=True)
+            return FileResponse(_pdf_cache["path"], media_type="application/pdf", headers=pdf_headers)
 
-        # Step 3: Create charts
-        print("[DEBUG] Creating charts...", flush=True)
-        charts = chart_generator.create_charts(df)
+        # Step 2-4: KPIs, charts and summary (shared with /api/dashboard)
+        print("[DEBUG] Building dashboard payload...", flush=True)
+        payload = await get_dashboard_payload(df, version)
+        kpis, charts, summary = payload["kpis"], payload["charts"], payload["summary"]
+        print(f"[DEBUG] KPIs: {kpis}", flush=True)
         print(f"[DEBUG] Charts keys: {list(charts.keys())}", flush=True)
-
-        # Step 4: Generate summary
-        print("[DEBUG] Generating AI summary...", flush=True)
-        summary = llm_handler.generate_ai_summary(df, kpis)
         print(f"[DEBUG] Summary length: {len(summary)} characters", flush=True)
 
-        # Step 5: Create PDF
+        # Step 5: Create PDF straight into a file, so the bytes are never held in memory
         print("[DEBUG] Creating PDF report...", flush=True)
-        pdf_bytes = pdf_generator.create_pdf_report(kpis, summary, charts, df)
-        print(f"[DEBUG] PDF generated: {len(pdf_bytes)} bytes", flush=True)
-
-        # Step 6: Return PDF
+        os.makedirs(data_handler.TEMP_STORAGE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=data_handler.TEMP_STORAGE_DIR, suffix=".pdf", delete=False,
+                                         buffering=PDF_WRITE_BUFFER_SIZE) as sink:
+            try:
+                await pdf_generator.create_pdf_report(kpis, summary, charts, df, sink=sink)
+            except Exception:
+                os.remove(sink.name)
+                raise
+        print(f"[DEBUG] PDF generated: {os.path.getsize(sink.name)} bytes", flush=True)
+
+        # Step 6: Stream the file back. Only keep a PDF built from a cached (i.e. successful) payload.
         print("[DEBUG] Returning PDF response...", flush=True)
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment;filename=dashboard_report.pdf"}
-        )
+        if _dashboard_cache["version"] != version:
+            return FileResponse(sink.name, media_type="application/pdf", headers=pdf_headers,
+                                background=BackgroundTask(os.remove, sink.name))
+
+        pdf_path = os.path.join(data_handler.TEMP_STORAGE_DIR, f"dashboard_report_v{version}.pdf")
+        os.replace(sink.name, pdf_path)
+        previous_path = _pdf_cache["path"]
+        _pdf_cache["version"] = version
+        _pdf_cache["path"] = pdf_path
+        if previous_path and previous_path != pdf_path and os.path.exists(previous_path):
+            os.remove(previous_path)
+        return FileResponse(pdf_path, media_type="application/pdf", headers=pdf_headers)
 
     except ValueError as e:
         print(f"[ERROR] ValueError: {e}", flush=True)
@@ -1,4 +1,6 @@
 # Creates Plotly charts
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.io as pio
@@ -6,54 +8,105 @@ import plotly.io as pio
 # Set a professional, dark theme for charts
 pio.templates.default = "plotly_dark"
 
-def create_charts(df: pd.DataFrame) -> dict:
-    """Creates a dictionary of Plotly charts as JSON strings."""
-    charts = {}
-
-    # 1. Sales by Product (bar)
-    sales_by_product = df.groupby('Product')['Sales'].sum().reset_index().sort_values('Sales', ascending=False)
-    fig1 = px.bar(sales_by_product, x='Product', y='Sales', title="Total Sales by Product",
-                  labels={'Sales': 'Total Sales ($)', 'Product': 'Product Name'})
-    charts['sales_by_product'] = fig1.to_json()
-
-    # 2. Sales by Region (pie)
-    sales_by_region = df.groupby('Region')['Sales'].sum().reset_index().sort_values('Sales', ascending=False)
-    fig2 = px.pie(sales_by_region, names='Region', values='Sales', title="Sales Distribution by Region", hole=0.3)
-    charts['sales_by_region'] = fig2.to_json()
-
-    # 3. Customer Satisfaction vs. Units Sold (scatter)
-    fig3 = px.scatter(df, x='Units Sold', y='Customer Satisfaction', color='Product',
-                      size='Sales', hover_name='Region', title="Satisfaction vs. Units Sold",
-                      labels={'Units Sold': 'Units Sold', 'Customer Satisfaction': 'Customer Satisfaction (1-5)'})
-    charts['satisfaction_vs_units'] = fig3.to_json()
-
-    # 4. Units Sold by Region and Product (stacked bar)
-    units_by_region_product = df.groupby(['Region', 'Product'])['Units Sold'].sum().reset_index()
-    fig4 = px.bar(units_by_region_product, x='Region', y='Units Sold', color='Product',
-                  title="Units Sold by Region and Product", barmode='stack',
-                  labels={'Units Sold': 'Units Sold', 'Region': 'Region'})
-    charts['units_by_region_product'] = fig4.to_json()
-
-    # 5. Average Customer Satisfaction by Product (bar)
-    avg_satisfaction_product = df.groupby('Product')['Customer Satisfaction'].mean().reset_index().sort_values('Customer Satisfaction', ascending=False)
-    fig5 = px.bar(avg_satisfaction_product, x='Product', y='Customer Satisfaction',
-                  title="Average Customer Satisfaction by Product",
-                  labels={'Customer Satisfaction': 'Average Satisfaction (1-5)', 'Product': 'Product'})
-    charts['avg_satisfaction_by_product'] = fig5.to_json()
-
-    # 6. Sales vs Units Sold Scatter Plot (by Product)
-    fig6 = px.scatter(df, x='Units Sold', y='Sales', color='Product',
-                      hover_name='Region', title="Sales vs Units Sold by Product",
-                      labels={'Units Sold': 'Units Sold', 'Sales': 'Sales ($)'})
-    charts['sales_vs_units_scatter'] = fig6.to_json()
-
-    # 7. Sales Efficiency Heatmap (Sales per Unit Sold) by Region and Product
-    df['Sales per Unit'] = df['Sales'] / df['Units Sold']
-    sales_efficiency = df.groupby(['Region', 'Product'])['Sales per Unit'].mean().reset_index()
-    fig7 = px.density_heatmap(sales_efficiency, x='Region', y='Product', z='Sales per Unit',
+CHART_WORKERS = 4
+
+
+def _aggregate(df: pd.DataFrame) -> dict:
+    """Builds each grouping once and derives every aggregate the charts need."""
+    g_prod = df.groupby('Product', sort=False)
+    g_reg = df.groupby('Region', sort=False)
+    g_rp = df.groupby(['Region', 'Product'])
+    rp_totals = g_rp[['Sales', 'Units Sold']].sum()
+
+    # Mean of the per-row ratio, computed on local arrays so the shared dataframe is never mutated
+    codes = g_rp.ngroup().to_numpy()
+    ratio = df['Sales'].to_numpy(dtype=float) / df['Units Sold'].to_numpy(dtype=float)
+    valid = (codes >= 0) & ~np.isnan(ratio)
+    n_groups = len(rp_totals)
+    ratio_sums = np.bincount(codes[valid], weights=ratio[valid], minlength=n_groups)
+    ratio_counts = np.bincount(codes[valid], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sales_per_unit = ratio_sums / ratio_counts
+
+    return {
+        "sales_by_product": g_prod['Sales'].sum().reset_index().sort_values('Sales', ascending=False),
+        "sales_by_region": g_reg['Sales'].sum().reset_index().sort_values('Sales', ascending=False),
+        "units_by_region_product": rp_totals['Units Sold'].reset_index(),
+        "avg_satisfaction_product": g_prod['Customer Satisfaction'].mean().reset_index().sort_values('Customer Satisfaction', ascending=False),
+        "sales_efficiency": pd.Series(sales_per_unit, index=rp_totals.index, name='Sales per Unit').reset_index(),
+    }
+
+
+# 1. Sales by Product (bar)
+def _chart_sales_by_product(df: pd.DataFrame, aggs: dict):
+    fig = px.bar(aggs["sales_by_product"], x='Product', y='Sales', title="Total Sales by Product",
+                 labels={'Sales': 'Total Sales ($)', 'Product': 'Product Name'})
+    return 'sales_by_product', fig.to_json()
+
+
+# 2. Sales by Region (pie)
+def _chart_sales_by_region(df: pd.DataFrame, aggs: dict):
+    fig = px.pie(aggs["sales_by_region"], names='Region', values='Sales', title="Sales Distribution by Region", hole=0.3)
+    return 'sales_by_region', fig.to_json()
+
+
+# 3. Customer Satisfaction vs. Units Sold (scatter)
+def _chart_satisfaction_vs_units(df: pd.DataFrame, aggs: dict):
+    fig = px.scatter(df, x='Units Sold', y='Customer Satisfaction', color='Product',
+                     size='Sales', hover_name='Region', title="Satisfaction vs. Units Sold",
+                     labels={'Units Sold': 'Units Sold', 'Customer Satisfaction': 'Customer Satisfaction (1-5)'})
+    return 'satisfaction_vs_units', fig.to_json()
+
+
+# 4. Units Sold by Region and Product (stacked bar)
+def _chart_units_by_region_product(df: pd.DataFrame, aggs: dict):
+    fig = px.bar(aggs["units_by_region_product"], x='Region', y='Units Sold', color='Product',
+                 title="Units Sold by Region and Product", barmode='stack',
+                 labels={'Units Sold': 'Units Sold', 'Region': 'Region'})
+    return 'units_by_region_product', fig.to_json()
+
+
+# 5. Average Customer Satisfaction by Product (bar)
+def _chart_avg_satisfaction_by_product(df: pd.DataFrame, aggs: dict):
+    fig = px.bar(aggs["avg_satisfaction_product"], x='Product', y='Customer Satisfaction',
+                 title="Average Customer Satisfaction by Product",
+                 labels={'Customer Satisfaction': 'Average Satisfaction (1-5)', 'Product': 'Product'})
+    return 'avg_satisfaction_by_product', fig.to_json()
+
+
+# 6. Sales vs Units Sold Scatter Plot (by Product)
+def _chart_sales_vs_units_scatter(df: pd.DataFrame, aggs: dict):
+    fig = px.scatter(df, x='Units Sold', y='Sales', color='Product',
+                     hover_name='Region', title="Sales vs Units Sold by Product",
+                     labels={'Units Sold': 'Units Sold', 'Sales': 'Sales ($)'})
+    return 'sales_vs_units_scatter', fig.to_json()
+
+
+# 7. Sales Efficiency Heatmap (Sales per Unit Sold) by Region and Product
+def _chart_sales_efficiency_heatmap(df: pd.DataFrame, aggs: dict):
+    fig = px.density_heatmap(aggs["sales_efficiency"], x='Region', y='Product', z='Sales per Unit',
                              color_continuous_scale='Viridis',
                              title="Sales Efficiency (Sales per Unit Sold) by Region and Product",
                              labels={'Sales per Unit': 'Sales per Unit Sold ($)'})
-    charts['sales_efficiency_heatmap'] = fig7.to_json()
+    return 'sales_efficiency_heatmap', fig.to_json()
+
+
+CHART_BUILDERS = [
+    _chart_sales_by_product,
+    _chart_sales_by_region,
+    _chart_satisfaction_vs_units,
+    _chart_units_by_region_product,
+    _chart_avg_satisfaction_by_product,
+    _chart_sales_vs_units_scatter,
+    _chart_sales_efficiency_heatmap,
+]
+
+
+def create_charts(df: pd.DataFrame) -> dict:
+    """Creates a dictionary of Plotly charts as JSON strings."""
+    # Aggregate up front so the worker threads only read finished frames
+    aggs = _aggregate(df)
 
-    return charts
+    with ThreadPoolExecutor(max_workers=CHART_WORKERS) as executor:
+        results = executor.map(lambda build: build(df, aggs), CHART_BUILDERS)
+        return dict(results)
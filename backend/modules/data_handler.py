@@ -6,22 +6,35 @@ import os # <-- NEW: Import the 'os' module to check for files
 # --- NEW: Define a path for our temporary storage ---
 # This will create a 'temp_storage' folder inside your 'backend' directory
 TEMP_STORAGE_DIR = "temp_storage"
-TEMP_DATA_PATH = os.path.join(TEMP_STORAGE_DIR, "current_data.csv")
+# Parquet keeps the cleaned dtypes and is much faster to reload than CSV
+TEMP_DATA_PATH = os.path.join(TEMP_STORAGE_DIR, "current_data.parquet")
+# Older deployments persisted CSV; still read it if no Parquet file exists yet
+LEGACY_CSV_PATH = os.path.join(TEMP_STORAGE_DIR, "current_data.csv")
 # ----------------------------------------------------
 
 # In-memory storage for the dataframe (acts as a quick cache).
 df_storage = {}
 
-def load_and_clean_data(file_content: bytes, filename: str) -> pd.DataFrame:
-    """Loads data from file bytes, cleans it, saves it to a temp file, and returns a DataFrame."""
+# Bumped on every successful upload so callers can invalidate derived caches.
+DATA_VERSION = 0
+
+def load_and_clean_data(file_content, filename: str) -> pd.DataFrame:
+    """
+    Loads data from file bytes (or a binary file object), cleans it, saves it to a temp file,
+    and returns a DataFrame.
+    """
+    global DATA_VERSION
+    source = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
     try:
         # Create the temp directory if it doesn't exist
         os.makedirs(TEMP_STORAGE_DIR, exist_ok=True) # <-- NEW
 
         if filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(file_content))
+            # pyarrow parses in parallel; the columns still come back as regular numpy dtypes,
+            # which every pandas/matplotlib code path the chat can generate supports
+            df = pd.read_csv(source, engine='pyarrow')
         elif filename.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(io.BytesIO(file_content))
+            df = pd.read_excel(source)
         else:
             raise ValueError("Unsupported file type")
 
@@ -33,16 +46,17 @@ def load_and_clean_data(file_content: bytes, filename: str) -> pd.DataFrame:
             if col in df.columns:
                 df[col] = pd.to_numeric(df[col], errors='coerce')
 
-        for col in df.select_dtypes(include=['number']).columns:
-            if df[col].isnull().any():
-                df[col].fillna(df[col].mean(), inplace=True)
-        
-        # NOTE: We keep dropna to ensure the saved data is always clean.
-        df.dropna(subset=['Region', 'Product', 'Month'], inplace=True)
+        # Fill missing numbers with the column mean in one pass over the numeric block
+        numeric = df.select_dtypes(include=['number'])
+        df[numeric.columns] = numeric.fillna(numeric.mean())
+
+        # NOTE: We keep dropping incomplete rows to ensure the saved data is always clean.
+        df = df.loc[df[['Region', 'Product', 'Month']].notna().all(axis=1)]
 
         # --- NEW: Save the cleaned data to disk and also cache in memory ---
-        df.to_csv(TEMP_DATA_PATH, index=False)
+        df.to_parquet(TEMP_DATA_PATH, engine='pyarrow', compression='zstd', index=False)
         df_storage['current'] = df
+        DATA_VERSION += 1
         # -----------------------------------------------------------------
         
         return df
@@ -61,11 +75,18 @@ def get_dataframe() -> pd.DataFrame:
     # 2. If not in memory, try to load from the disk file (after a server restart)
     if os.path.exists(TEMP_DATA_PATH):
         print("Loading data from temporary file...") # Log for debugging
-        # When reading from CSV, we must tell pandas to parse the 'Month' column as a date again
-        df = pd.read_csv(TEMP_DATA_PATH, parse_dates=['Month'])
+        # Parquet preserves dtypes, so 'Month' comes back as a datetime column
+        df = pd.read_parquet(TEMP_DATA_PATH, engine='pyarrow')
         # Put it back into memory for the next request
         df_storage['current'] = df
         return df
 
+    if os.path.exists(LEGACY_CSV_PATH):
+        print("Loading data from legacy CSV file...")
+        # When reading from CSV, we must tell pandas to parse the 'Month' column as a date again
+        df = pd.read_csv(LEGACY_CSV_PATH, parse_dates=['Month'])
+        df_storage['current'] = df
+        return df
+
     # 3. If it's not in memory or on disk, then no data has been uploaded yet.
     raise ValueError("No data has been uploaded yet.")
\ No newline at end of file
@@ -0,0 +1,141 @@
+# Specialised ARIMA(1,1,1) fit and forecast compiled with Numba
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def _diff(y):
+    """First difference of a 1-D series."""
+    out = np.empty(y.shape[0] - 1)
+    for i in range(1, y.shape[0]):
+        out[i - 1] = y[i] - y[i - 1]
+    return out
+
+
+@njit(cache=True)
+def _arma11_residuals(phi, theta, w):
+    """Innovations e_t = w_t - phi*w_{t-1} - theta*e_{t-1}; missing values carry the prediction forward."""
+    n = w.shape[0]
+    e = np.zeros(n)
+    prev_w = 0.0
+    prev_e = 0.0
+    for t in range(n):
+        pred = phi * prev_w + theta * prev_e
+        if np.isnan(w[t]):
+            prev_w = pred
+            prev_e = 0.0
+        else:
+            e[t] = w[t] - pred
+            prev_w = w[t]
+            prev_e = e[t]
+    return e, prev_w, prev_e
+
+
+@njit(cache=True)
+def _arma11_loglik(phi, theta, w):
+    """Concentrated Gaussian log-likelihood of a zero-mean ARMA(1,1) on the differenced series."""
+    e, _, _ = _arma11_residuals(phi, theta, w)
+    n = 0
+    sse = 0.0
+    for t in range(w.shape[0]):
+        if not np.isnan(w[t]):
+            sse += e[t] * e[t]
+            n += 1
+    if n == 0:
+        return -np.inf
+    sigma2 = max(sse / n, 1e-12)
+    return -0.5 * n * (np.log(2.0 * np.pi * sigma2) + 1.0)
+
+
+@njit(cache=True)
+def _objective(x, w):
+    # tanh keeps both coefficients inside the stationary / invertible region
+    return -_arma11_loglik(np.tanh(x[0]), np.tanh(x[1]), w)
+
+
+@njit(cache=True)
+def _nelder_mead_2d(w, max_iter=500, tol=1e-8):
+    """Minimises the negative log-likelihood over unconstrained (phi, theta)."""
+    simplex = np.array([[0.0, 0.0], [0.5, 0.0], [0.0, 0.5]])
+    values = np.empty(3)
+    for i in range(3):
+        values[i] = _objective(simplex[i], w)
+
+    for _ in range(max_iter):
+        order = np.argsort(values)
+        simplex = simplex[order]
+        values = values[order]
+        if abs(values[2] - values[0]) < tol:
+            break
+
+        centroid = (simplex[0] + simplex[1]) / 2.0
+        reflected = centroid + (centroid - simplex[2])
+        f_reflected = _objective(reflected, w)
+
+        if f_reflected < values[0]:
+            expanded = centroid + 2.0 * (centroid - simplex[2])
+            f_expanded = _objective(expanded, w)
+            if f_expanded < f_reflected:
+                simplex[2] = expanded
+                values[2] = f_expanded
+            else:
+                simplex[2] = reflected
+                values[2] = f_reflected
+        elif f_reflected < values[1]:
+            simplex[2] = reflected
+            values[2] = f_reflected
+        else:
+            contracted = centroid + 0.5 * (simplex[2] - centroid)
+            f_contracted = _objective(contracted, w)
+            if f_contracted < values[2]:
+                simplex[2] = contracted
+                values[2] = f_contracted
+            else:
+                # Shrink towards the best vertex
+                for i in range(1, 3):
+                    simplex[i] = simplex[0] + 0.5 * (simplex[i] - simplex[0])
+                    values[i] = _objective(simplex[i], w)
+
+    best = np.argmin(values)
+    return np.tanh(simplex[best, 0]), np.tanh(simplex[best, 1])
+
+
+@njit(cache=True)
+def _forecast(state, steps):
+    phi, theta, level, last_w, last_e = state[0], state[1], state[2], state[3], state[4]
+    out = np.empty(steps)
+    w_hat = phi * last_w + theta * last_e
+    for h in range(steps):
+        if h > 0:
+            w_hat = phi * w_hat
+        level += w_hat
+        out[h] = level
+    return out
+
+
+def fit_arima111(y: np.ndarray) -> np.ndarray:
+    """
+    Fits an ARIMA(1,1,1) without constant to a float64 series.
+    Returns the fitted state [phi, theta, last_level, last_diff, last_residual].
+    """
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    observed = np.flatnonzero(~np.isnan(y))
+    if observed.size < 3:
+        raise ValueError("At least three observations are required to fit ARIMA(1,1,1).")
+    # Trailing gaps have nothing to anchor the forecast on, so fit up to the last observation
+    y = y[:observed[-1] + 1]
+
+    w = _diff(y)
+    phi, theta = _nelder_mead_2d(w)
+    _, last_w, last_e = _arma11_residuals(phi, theta, w)
+    return np.array([phi, theta, y[-1], last_w, last_e])
+
+
+def forecast_arima111(state: np.ndarray, steps: int) -> np.ndarray:
+    """Forecasts `steps` values ahead from a state returned by `fit_arima111`."""
+    return _forecast(state, int(steps))
+
+
+def fit_forecast_arima111(y: np.ndarray, steps: int) -> np.ndarray:
+    """Fits ARIMA(1,1,1) to `y` and returns the next `steps` forecasted values."""
+    return forecast_arima111(fit_arima111(y), steps)
@@ -1,4 +1,5 @@
 # Generates KPIs and text insights
+import numpy as np
 import pandas as pd
 
 def generate_kpis(df: pd.DataFrame) -> dict:
@@ -15,17 +16,21 @@ def generate_kpis(df: pd.DataFrame) -> dict:
 
 def find_anomalies_and_opportunities(df: pd.DataFrame) -> dict:
     """Identifies interesting patterns like anomalies and opportunities."""
-    # Anomaly: High Sales, Low Satisfaction
-    high_sales_threshold = df['Sales'].quantile(0.75)
-    low_satisfaction_threshold = df['Customer Satisfaction'].quantile(0.25)
-    
-    anomaly = df[(df['Sales'] >= high_sales_threshold) & 
-                 (df['Customer Satisfaction'] <= low_satisfaction_threshold)]
+    sales = df['Sales'].to_numpy(dtype=float)
+    satisfaction = df['Customer Satisfaction'].to_numpy(dtype=float)
+
+    # One quantile pass per column (nan-aware, like Series.quantile)
+    high_sales_threshold = np.nanquantile(sales, 0.75)
+    low_satisfaction_threshold, high_satisfaction_threshold = np.nanquantile(satisfaction, [0.25, 0.75])
 
+    high_sales = sales >= high_sales_threshold
+    # Anomaly: High Sales, Low Satisfaction
+    anomaly_mask = high_sales & (satisfaction <= low_satisfaction_threshold)
     # Opportunity: High Sales, High Satisfaction
-    high_satisfaction_threshold = df['Customer Satisfaction'].quantile(0.75)
-    opportunity = df[(df['Sales'] >= high_sales_threshold) & 
-                     (df['Customer Satisfaction'] >= high_satisfaction_threshold)]
+    opportunity_mask = high_sales & (satisfaction >= high_satisfaction_threshold)
+
+    anomaly = df.iloc[np.flatnonzero(anomaly_mask)]
+    opportunity = df.iloc[np.flatnonzero(opportunity_mask)]
 
     return {
         "anomaly": anomaly.to_dict(orient='records'),
@@ -3,18 +3,255 @@
 import os
 import google.generativeai as genai
 import pandas as pd
-import io
+import re
+import json
+import calendar
+import asyncio
+import numpy as np
+from cachetools import TTLCache
+from . import data_handler
+from .semantic_cache import SemanticCache
+from .rate_limiter import GeminiLimiter, estimate_tokens
 
 # Configure the Gemini API
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 model = genai.GenerativeModel('gemini-1.5-flash')
 
-def generate_ai_summary(df: pd.DataFrame, kpis: dict) -> str:
-    # This function remains unchanged.
-    data_summary = df.head().to_string()
-    buffer = io.StringIO()
-    df.info(verbose=False, buf=buffer)
-    schema_summary = buffer.getvalue()
+# Decoding settings per task: code is a single deterministic line, the summary a few paragraphs.
+# Capping the output keeps replies (and TPM usage) short.
+CODE_MAX_OUTPUT_TOKENS = 128
+CODE_GENERATION_CONFIG = genai.types.GenerationConfig(
+    max_output_tokens=CODE_MAX_OUTPUT_TOKENS, temperature=0.0, stop_sequences=["\n\n"]
+)
+SUMMARY_GENERATION_CONFIG = genai.types.GenerationConfig(max_output_tokens=700, temperature=0.4)
+
+# Every generate_content call goes through this limiter so bursts queue up instead of hitting 429s
+gemini_limiter = GeminiLimiter(
+    rpm=int(os.getenv("GEMINI_RPM", "15")),
+    tpm=int(os.getenv("GEMINI_TPM", "1000000")),
+    concurrency=int(os.getenv("GEMINI_CONCURRENCY", "4")),
+)
+
+# --- STATIC CODE-GENERATION PROMPT ---
+# Sent as the model's system instruction, so each chat request only carries the
+# schema, dates and conversation.
+CODE_SYSTEM_PROMPT = """
+You are an expert Python data analyst. Your job is to convert a user's question into a single, executable line of Python code to query a pandas DataFrame.
+
+**PERSONA & RULES:**
+1.  **You are the Decision Maker:** Analyze the user's intent. Do they want a specific number, a table, a plot, or a forecast? Choose the best tool for the job.
+2.  **Combine Filters:** Users will often ask for multiple things at once (e.g., "sales for product A in the South region last month"). Your code must combine all filters correctly.
+3.  **Handle Ambiguity:** If a term is vague (e.g., "best product"), make a reasonable assumption (e.g., highest sales) and state it in your answer. Do not just error out.
+4.  **Code Only:** Your output MUST be ONLY the single line of Python code and nothing else.
+    - **Batch mode:** When one message contains several numbered requests and asks for a JSON array, reply with that JSON array instead, holding one such line of code per request, in order.
+
+**AVAILABLE TOOLS:**
+- DataFrame is named `df`. Its columns and the meaning of relative dates are given in the CONTEXT section of each request.
+- Use `plot_to_base64()` for any visual chart/graph/plot requests. Always draw onto the provided `ax` by passing `ax=ax` to `.plot()`.
+- Use `get_forecast()` for any prediction/forecast/projection requests. This tool can now take a `filters` dictionary.
+- Date Format: For specific dates like "in November 2024" or "on 11-2024", use the filter `df['Month'].dt.to_period('M') == '2024-11'`.
+
+**ADVANCED EXAMPLES (How to Think):**
+In these examples `<last_month>` stands for the 'last month' value from the CONTEXT section.
+
+- User: "Plot me a graph product wise for last month"
+  - Intent: Plotting. Filters: 'last month'.
+  - Assistant Code: `plot_to_base64(df[df['Month'].dt.to_period('M') == '<last_month>'].groupby('Product')['Sales'].sum().plot(kind='bar', title='Sales by Product for <last_month>', ax=ax))`
+
+- User: "what product is sold more at 11th month 2024"
+  - Intent: Data retrieval. Filters: '11-2024'. Assumption: "sold more" means by 'Sales'.
+  - Assistant Code: `df[df['Month'].dt.to_period('M') == '2024-11'].groupby('Product')['Sales'].sum().idxmax()`
+
+- User: "what is the sales of product b last month"
+  - Intent: Data retrieval. Filters: 'Product B', 'last month'.
+  - Assistant Code: `df[(df['Product'] == 'Product B') & (df['Month'].dt.to_period('M') == '<last_month>')]['Sales'].sum()`
+
+- User: "Forecast sales for the next 3 months for product a"
+  - Intent: Forecasting with a filter.
+  - Assistant Code: `get_forecast(df, target_column='Sales', periods=3, filters={'Product': 'Product A'})`
+
+- User: "show me the best performing product"
+  - Intent: Data retrieval. Ambiguity: "best performing". Assumption: by total sales.
+  - Assistant Code: `df.groupby('Product')['Sales'].sum().idxmax()`
+"""
+
+# Per-request prompt: only the data-dependent context and the conversation are sent;
+# the persona, rules and examples live in the system instruction.
+# The head only changes with the data, so it is formatted once per data version.
+CODE_PROMPT_HEAD = """
+    **CONTEXT:**
+    - Columns are: {schema}.
+    - Relative Dates: 'last month' means '{previous_month}', 'latest month' means '{latest_month}'.
+"""
+CODE_PROMPT_TAIL = """
+    **CONVERSATION HISTORY:**
+    {history}
+
+    **Assistant Code:**
+    """
+
+# The static prompt is bound once as the model's system instruction
+_code_model = genai.GenerativeModel('gemini-1.5-flash', system_instruction=CODE_SYSTEM_PROMPT)
+
+# Generated code for standalone questions, keyed by (data version, schema, normalized question)
+_code_cache = TTLCache(maxsize=1024, ttl=3600)
+# Questions containing these words depend on earlier turns, so they are never served from the cache
+_CONTEXT_WORDS = {"it", "its", "that", "this", "those", "these", "them", "they", "same", "previous"}
+
+def _normalize_question(text: str) -> str:
+    """Lowercases, strips punctuation and collapses whitespace so trivially different phrasings share a key."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+# Prompt context derived from the data; only changes when a new file is uploaded
+_schema_cache = {"key": None}
+
+def _get_prompt_context(df: pd.DataFrame) -> dict:
+    """Returns the column list and latest/previous month strings, recomputed once per data version."""
+    key = (data_handler.DATA_VERSION, id(df))
+    if _schema_cache["key"] != key:
+        # Format only the distinct month values, via to_period rather than per-row strftime
+        unique_months = pd.DatetimeIndex(df['Month'].dropna().unique()).to_period('M').unique().sort_values().astype(str).tolist()
+        # Words that name data values (regions, products, ...) for the semantic cache guard
+        vocabulary = set()
+        # Normalized data value -> (column, value), used by the local intent router
+        values = {}
+        for column in df.select_dtypes(include=['object', 'string']).columns:
+            for value in df[column].dropna().unique():
+                normalized = _normalize_question(str(value))
+                vocabulary.update(normalized.split())
+                values.setdefault(normalized, (column, value))
+        _schema_cache.update(
+            key=key,
+            schema=df.columns.tolist(),
+            vocabulary=vocabulary,
+            schema_words=set(_normalize_question(" ".join(map(str, df.columns))).split()),
+            values=values,
+            latest_month=unique_months[-1] if unique_months else "N/A",
+            previous_month=unique_months[-2] if len(unique_months) > 1 else "N/A",
+        )
+        _schema_cache["prompt_head"] = CODE_PROMPT_HEAD.format_map(_schema_cache)
+    return _schema_cache
+
+# --- LOCAL INTENT ROUTER ---
+# The most common questions map onto fixed code templates, so they are answered without an LLM call.
+# Patterns run against the normalized question; unmatched questions go to Gemini as before.
+_METRICS = {"sales": "Sales", "revenue": "Sales", "units": "Units Sold", "units sold": "Units Sold"}
+_METRIC = r"(?P<metric>sales|revenue|units sold|units)"
+_PERIODS = {"last month": "previous_month", "previous month": "previous_month",
+            "latest month": "latest_month", "this month": "latest_month"}
+_PERIOD = r"(?P<period>last month|previous month|latest month|this month)"
+
+def _route_top(match, context):
+    column = "Region" if match["dimension"] == "region" else "Product"
+    return f"df.groupby({column!r})['Sales'].sum().idxmax()"
+
+def _route_total(match, context):
+    return f"df[{_METRICS[match['metric']]!r}].sum()"
+
+def _route_entity_total(match, context):
+    entity = context["values"].get(match["entity"])
+    if entity is None:
+        return None
+    filters = f"(df[{entity[0]!r}] == {entity[1]!r})"
+    if match["period"]:
+        filters += f" & (df['Month'].dt.to_period('M') == {context[_PERIODS[match['period']]]!r})"
+    return f"df[{filters}][{_METRICS[match['metric']]!r}].sum()"
+
+def _route_forecast(match, context):
+    code = f"get_forecast(df, target_column={_METRICS[match['metric']]!r}, periods={int(match['periods'])}"
+    if match["entity"]:
+        entity = context["values"].get(match["entity"])
+        if entity is None:
+            return None
+        code += f", filters={{{entity[0]!r}: {entity[1]!r}}}"
+    return code + ")"
+
+_LOCAL_INTENTS = [
+    (re.compile(r"^(?:(?:what|which) is )?(?:show me )?(?:the )?(?:best|top)(?: performing| selling)? (?P<dimension>product|region)$"), _route_top),
+    (re.compile(rf"^(?:what (?:is|are) )?(?:the )?total {_METRIC}$"), _route_total),
+    (re.compile(rf"^(?:what (?:is|are|were) )?(?:the )?(?:total )?{_METRIC} (?:of|for) (?P<entity>.+?)(?: (?:in )?{_PERIOD})?$"), _route_entity_total),
+    (re.compile(rf"^forecast {_METRIC} (?:for )?(?:the )?next (?P<periods>\d+) months?(?: for (?P<entity>.+))?$"), _route_forecast),
+]
+
+def _route_locally(question: str, context: dict):
+    """Returns template code for a recognised question, or None to defer to the LLM."""
+    schema = set(context["schema"])
+    if not {"Month", "Region", "Product", "Sales", "Units Sold"} <= schema:
+        return None
+    for pattern, build in _LOCAL_INTENTS:
+        match = pattern.match(question)
+        if match:
+            return build(match, context)
+    return None
+
+def _latest_question(history: list):
+    """Returns the normalized text of the latest user message, or None if there is none."""
+    last_user = next((m['content'] for m in reversed(history) if m['role'] == 'user'), None)
+    return _normalize_question(last_user) if last_user else None
+
+def _code_cache_key(df: pd.DataFrame, history: list):
+    """Returns the cache key for the latest user question, or None if it shouldn't be cached."""
+    question = _latest_question(history)
+    if not question or _CONTEXT_WORDS.intersection(question.split()):
+        return None
+    return (data_handler.DATA_VERSION, hash(tuple(df.columns)), question)
+
+# Second tier behind _code_cache: reuses code for rephrasings of an earlier question
+EMBEDDING_MODEL = 'models/text-embedding-004'
+_semantic_cache = SemanticCache(directory=os.path.join(data_handler.TEMP_STORAGE_DIR, "semantic_cache"))
+# Words that change a question's answer while barely moving its embedding ("sales in november" vs
+# "sales in october", "highest" vs "lowest"). Like data values, column names and numbers they must
+# match exactly, after mapping synonyms onto one class so "best" and "top" still share a guard.
+_GUARD_CLASSES = {
+    **{name.lower(): name.lower() for name in calendar.month_name[1:]},
+    **{abbr.lower(): name.lower() for abbr, name in zip(calendar.month_abbr[1:], calendar.month_name[1:])},
+    "sept": "september",
+    **dict.fromkeys(["best", "top", "highest", "most", "max", "maximum"], "max"),
+    **dict.fromkeys(["worst", "bottom", "lowest", "least", "min", "minimum"], "min"),
+    **dict.fromkeys(["average", "mean", "avg"], "mean"),
+    **dict.fromkeys(["total", "sum"], "sum"),
+    **dict.fromkeys(["last", "previous"], "prev"),
+    **dict.fromkeys(["latest", "current"], "latest"),
+    "median": "median", "next": "next", "first": "first", "final": "final",
+}
+
+def _semantic_guard(question: str, context: dict) -> frozenset:
+    """Tokens of the question that must match exactly for a cached answer to be reused."""
+    guard = set()
+    for token in question.split():
+        if token in _GUARD_CLASSES:
+            guard.add(_GUARD_CLASSES[token])
+        elif token in context["vocabulary"] or token in context["schema_words"] or token.isdigit():
+            guard.add(token)
+    return frozenset(guard)
+
+# Freshly generated code, held until it has run successfully; only then is it cached
+_pending_code = TTLCache(maxsize=256, ttl=600)
+
+async def _embed_question(question: str):
+    """Embeds a normalized question, or returns None if the embedding call fails."""
+    try:
+        result = await genai.embed_content_async(model=EMBEDDING_MODEL, content=question, task_type="semantic_similarity")
+        return np.asarray(result['embedding'], dtype=np.float64)
+    except Exception as e:
+        print(f"Question embedding failed, skipping semantic cache: {e}")
+        return None
+
+# Compact schema and sample for the summary prompt, rebuilt once per data version
+_summary_parts = {"key": None}
+
+def _get_summary_parts(df: pd.DataFrame) -> dict:
+    key = (data_handler.DATA_VERSION, id(df), len(df))
+    if _summary_parts["key"] != key:
+        schema = f"{len(df)} rows\n" + "\n".join(f"{column}: {dtype}" for column, dtype in df.dtypes.items())
+        sample = json.dumps(df.head().to_dict('records'), default=str)
+        _summary_parts.update(key=key, schema=schema, sample=sample)
+    return _summary_parts
+
+async def generate_ai_summary(df: pd.DataFrame, kpis: dict) -> str:
+    parts = _get_summary_parts(df)
+    data_summary = parts["sample"]
+    schema_summary = parts["schema"]
     prompt = f"""
     You are an expert business analyst. Based on the following data summary, schema, and key performance indicators (KPIs), provide a concise executive summary for a business dashboard.
     **Instructions:**
@@ -29,72 +266,157 @@ def generate_ai_summary(df: pd.DataFrame, kpis: dict) -> str:
     **Executive Summary:**
     """
     try:
-        response = model.generate_content(prompt)
+        response = await gemini_limiter.call(
+            model.generate_content_async, prompt, generation_config=SUMMARY_GENERATION_CONFIG,
+            tokens=estimate_tokens(prompt) + SUMMARY_GENERATION_CONFIG.max_output_tokens,
+        )
         return response.text
     except Exception as e:
         return f"Error generating summary: {e}"
 
 
-def generate_code_from_query(df: pd.DataFrame, history: list) -> str:
-    """Translates a natural language query into Pandas code using Gemini, with conversation context."""
-    schema = df.columns.tolist()
-    unique_months = sorted(df['Month'].dt.strftime('%Y-%m').unique())
-    latest_month = unique_months[-1] if unique_months else "N/A"
-    previous_month = unique_months[-2] if len(unique_months) > 1 else "N/A"
-
-    formatted_history = ""
-    for message in history:
-        role = "User" if message['role'] == 'user' else "Assistant"
-        formatted_history += f"{role}: {message['content']}\n"
-    
-    # --- NEW, ADVANCED PROMPT ---
-    prompt = f"""
-    You are an expert Python data analyst. Your job is to convert a user's question into a single, executable line of Python code to query a pandas DataFrame.
+# --- CODE REQUEST BATCHING ---
+# Code requests arriving within a short window share one Gemini call, so a burst of
+# chat messages costs one request (and one pass over the system instruction).
+CODE_BATCH_WINDOW = 0.05  # seconds
+CODE_BATCH_MAX = 8
+_code_batch = {"loop": None, "queue": None, "worker": None}
+# A batched reply must be a JSON array with one code string per request
+CODE_BATCH_SCHEMA = {"type": "array", "items": {"type": "string"}}
+# Strong references to in-flight batches; the event loop only keeps weak ones to tasks
+_code_batch_tasks = set()
 
-    **PERSONA & RULES:**
-    1.  **You are the Decision Maker:** Analyze the user's intent. Do they want a specific number, a table, a plot, or a forecast? Choose the best tool for the job.
-    2.  **Combine Filters:** Users will often ask for multiple things at once (e.g., "sales for product A in the South region last month"). Your code must combine all filters correctly.
-    3.  **Handle Ambiguity:** If a term is vague (e.g., "best product"), make a reasonable assumption (e.g., highest sales) and state it in your answer. Do not just error out.
-    4.  **Code Only:** Your output MUST be ONLY the single line of Python code and nothing else.
+async def _generate_code_text(prompt: str, generation_config=CODE_GENERATION_CONFIG) -> str:
+    response = await gemini_limiter.call(
+        _code_model.generate_content_async, prompt, generation_config=generation_config,
+        tokens=estimate_tokens(prompt) + generation_config.max_output_tokens,
+    )
+    return response.text
 
-    **AVAILABLE TOOLS & CONTEXT:**
-    - DataFrame is named `df`.
-    - Columns are: {schema}.
-    - Use `plot_to_base64()` for any visual chart/graph/plot requests.
-    - Use `get_forecast()` for any prediction/forecast/projection requests. This tool can now take a `filters` dictionary.
-    - Relative Dates: 'last month' means '{previous_month}', 'latest month' means '{latest_month}'.
-    - Date Format: For specific dates like "in November 2024" or "on 11-2024", use the filter `df['Month'].dt.strftime('%Y-%m') == '2024-11'`.
+def _parse_code_batch(text: str, expected: int):
+    """Returns the list of code lines from a batched response, or None if it is malformed."""
+    text = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    try:
+        codes = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(codes, list) or len(codes) != expected or not all(isinstance(c, str) for c in codes):
+        return None
+    return codes
 
-    **ADVANCED EXAMPLES (How to Think):**
+async def _run_code_batch(batch: list):
+    prompts = [prompt for prompt, _ in batch]
+    try:
+        if len(batch) == 1:
+            results = [await _generate_code_text(prompts[0])]
+        else:
+            sections = "\n".join(f"**REQUEST {i}:**\n{prompt}" for i, prompt in enumerate(prompts, 1))
+            combined = (
+                f"Answer each of the following {len(prompts)} independent requests. "
+                "Each has its own CONTEXT and CONVERSATION HISTORY.\n"
+                f"{sections}\n"
+                "Produce a JSON array with one code line per request, in order:"
+            )
+            # Room for one line per request, and no blank-line stop so a pretty-printed array isn't cut short
+            batch_config = genai.types.GenerationConfig(
+                max_output_tokens=CODE_MAX_OUTPUT_TOKENS * len(prompts), temperature=0.0,
+                response_mime_type="application/json", response_schema=CODE_BATCH_SCHEMA,
+            )
+            results = _parse_code_batch(await _generate_code_text(combined, batch_config), len(prompts))
+            if results is None:
+                # Fall back to one call per request rather than guessing at the mapping
+                results = await asyncio.gather(*(_generate_code_text(p) for p in prompts), return_exceptions=True)
+    except Exception as e:
+        results = [e] * len(batch)
 
-    - User: "Plot me a graph product wise for last month"
-      - Intent: Plotting. Filters: 'last month'.
-      - Assistant Code: `plot_to_base64(df[df['Month'].dt.strftime('%Y-%m') == '{previous_month}'].groupby('Product')['Sales'].sum().plot(kind='bar', title='Sales by Product for {previous_month}'))`
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
 
-    - User: "what product is sold more at 11th month 2024"
-      - Intent: Data retrieval. Filters: '11-2024'. Assumption: "sold more" means by 'Sales'.
-      - Assistant Code: `df[df['Month'].dt.strftime('%Y-%m') == '2024-11'].groupby('Product')['Sales'].sum().idxmax()`
+async def _code_batch_worker(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + CODE_BATCH_WINDOW
+        while len(batch) < CODE_BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Keep collecting the next batch while this one is in flight
+        task = asyncio.create_task(_run_code_batch(batch))
+        _code_batch_tasks.add(task)
+        task.add_done_callback(_code_batch_tasks.discard)
 
-    - User: "what is the sales of product b last month"
-      - Intent: Data retrieval. Filters: 'Product B', 'last month'.
-      - Assistant Code: `df[(df['Product'] == 'Product B') & (df['Month'].dt.strftime('%Y-%m') == '{previous_month}')]['Sales'].sum()`
+async def _request_code(prompt: str) -> str:
+    """Queues a code-generation prompt for the next batch and waits for its raw response text."""
+    loop = asyncio.get_running_loop()
+    if _code_batch["loop"] is not loop:
+        _code_batch.update(loop=loop, queue=asyncio.Queue())
+        _code_batch["worker"] = loop.create_task(_code_batch_worker(_code_batch["queue"]))
+    future = loop.create_future()
+    await _code_batch["queue"].put((prompt, future))
+    return await future
 
-    - User: "Forecast sales for the next 3 months for product a"
-      - Intent: Forecasting with a filter.
-      - Assistant Code: `get_forecast(df, target_column='Sales', periods=3, filters={{'Product': 'Product A'}})`
 
-    - User: "show me the best performing product"
-      - Intent: Data retrieval. Ambiguity: "best performing". Assumption: by total sales.
-      - Assistant Code: `df.groupby('Product')['Sales'].sum().idxmax()`
+async def generate_code_from_query(df: pd.DataFrame, history: list) -> str:
+    """Translates a natural language query into Pandas code using Gemini, with conversation context."""
+    cache_key = _code_cache_key(df, history)
+    if cache_key is not None and cache_key in _code_cache:
+        return _code_cache[cache_key]
 
-    **CONVERSATION HISTORY:**
-    {formatted_history}
+    context = _get_prompt_context(df)
+    schema = context["schema"]
+    latest_month = context["latest_month"]
 
-    **Assistant Code:**
-    """
+    # The router's patterns are self-contained, so it also answers questions that only look
+    # context-dependent to the cache ("sales of product b this month")
+    question = _latest_question(history)
+    code = _route_locally(question, context) if question else None
+    if code is not None:
+        if cache_key is not None:
+            _code_cache[cache_key] = code
+        return code
+
+    embedding = None
+    if cache_key is not None:
+        semantic_scope = (tuple(schema), latest_month)
+        guard = _semantic_guard(question, context)
+        embedding = await _embed_question(question)
+        if embedding is not None:
+            code = await asyncio.to_thread(_semantic_cache.lookup, semantic_scope, embedding, guard)
+            if code is not None:
+                _code_cache[cache_key] = code
+                return code
+
+    formatted_history = "".join(
+        f"{'User' if message['role'] == 'user' else 'Assistant'}: {message['content']}\n" for message in history
+    )
+    prompt = context["prompt_head"] + CODE_PROMPT_TAIL.format(history=formatted_history)
     try:
-        response = model.generate_content(prompt)
-        code = response.text.strip().replace("`", "").replace("python", "")
+        text = await _request_code(prompt)
+        code = text.strip().replace("`", "").replace("python", "")
+        if cache_key is not None:
+            _pending_code[cache_key] = (code, semantic_scope, embedding, guard)
         return code
     except Exception as e:
-        return f"Error: LLM failed to generate code. {e}"
\ No newline at end of file
+        return f"Error: LLM failed to generate code. {e}"
+
+
+def record_code_success(df: pd.DataFrame, history: list, code: str):
+    """Caches LLM-generated code once it has executed without error, so broken code is never reused."""
+    cache_key = _code_cache_key(df, history)
+    pending = _pending_code.pop(cache_key, None) if cache_key is not None else None
+    if pending is None or pending[0] != code:
+        return
+    _, semantic_scope, embedding, guard = pending
+    _code_cache[cache_key] = code
+    if embedding is not None:
+        _semantic_cache.add(semantic_scope, embedding, guard, code)
\ No newline at end of file
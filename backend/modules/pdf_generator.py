@@ -1,37 +1,209 @@
+import os
+import asyncio
 import pathlib
-from jinja2 import Environment, FileSystemLoader
-from xhtml2pdf import pisa
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 import pandas as pd
-import plotly.io as pio
+import plotly
+import orjson
+from kaleido.scopes.plotly import PlotlyScope
 import io
-import base64
+import html
+import tempfile
 from datetime import datetime
+from . import data_handler
 
+# WeasyPrint lays out with Cairo/Pango and is much faster than xhtml2pdf, but it needs those
+# system libraries. Hosts without them keep working through the pure-Python xhtml2pdf renderer.
+# Only the OSError raised for missing native libraries falls back; an ImportError means the
+# installed WeasyPrint doesn't match the pinned API and should fail loudly.
+try:
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+    from weasyprint.urls import URLFetcher, URLFetcherResponse
+    PDF_ENGINE = "weasyprint"
+    # Loaded once at import instead of on every report
+    _font_config = FontConfiguration()
+except OSError as e:
+    from xhtml2pdf import pisa
+    PDF_ENGINE = "xhtml2pdf"
+    print(f"WeasyPrint unavailable ({e}); falling back to xhtml2pdf for PDF export.")
 
-def create_pdf_report(kpis: dict, summary: str, charts: dict, df: pd.DataFrame) -> bytes:
-    """Renders an HTML template with data and converts it to a PDF using xhtml2pdf."""
-    # Get the directory of the current script (modules/)
-    script_dir = pathlib.Path(__file__).parent
-    # Navigate up one level to the 'backend' directory
-    backend_dir = script_dir.parent.resolve()
-    
-    template_dir = backend_dir / "templates"
-    env = Environment(loader=FileSystemLoader(str(template_dir)))
-    template = env.get_template('report_template.html')
-
-    # Convert Plotly JSON charts to static images (base64) for the PDF
-    img_charts = {}
-    for key, chart_json in charts.items():
-        fig = pio.from_json(chart_json)
-        img_bytes = fig.to_image(format="png", scale=2)
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-        img_charts[key] = f"data:image/png;base64,{img_base64}"
+# --- Chart rendering ---
+# plotly's default Kaleido scope is one Chromium process behind a lock, so renders are
+# serialized. Each render thread gets its own long-lived scope (and process) instead.
+# Scopes start lazily on first use, so an idle worker only ever holds the one warmed up at startup.
+# CHART_RENDER_WORKERS overrides the pool size (default: up to 4, bounded by the CPU count).
+RENDER_WORKERS = max(1, int(os.getenv("CHART_RENDER_WORKERS", min(4, os.cpu_count() or 1))))
+_PLOTLYJS_PATH = os.path.join(os.path.dirname(os.path.abspath(plotly.__file__)), "package_data", "plotly.min.js")
+_render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="chart-render")
+_render_state = threading.local()
+
+def _get_kaleido_scope() -> PlotlyScope:
+    if not hasattr(_render_state, "scope"):
+        # Same plotly.js bundle and MathJax source that plotly.io.to_image configures
+        _render_state.scope = PlotlyScope(
+            plotlyjs=_PLOTLYJS_PATH,
+            mathjax="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.5/MathJax.js",
+        )
+    return _render_state.scope
+
+def _warm_up_scope():
+    try:
+        _get_kaleido_scope().transform({"data": [], "layout": {}}, format="png", width=10, height=10)
+    except Exception as e:
+        print(f"Chart renderer warm-up failed: {e}")
+
+def warm_up_renderers():
+    """Starts one render thread's Kaleido process in the background, ahead of the first PDF export."""
+    _render_executor.submit(_warm_up_scope)
+
+# The PDF is laid out at modest DPI, so charts render at 1x by default; set CHART_SCALE=2 for sharper images.
+# A fixed size spares Kaleido its autosize layout pass.
+CHART_SCALE = float(os.getenv("CHART_SCALE", "1"))
+CHART_WIDTH = 900
+CHART_HEIGHT = 500
+
+def _render_chart_png(chart_json: str) -> bytes:
+    # The PNG is deliberately not recompressed (e.g. with oxipng): WeasyPrint and xhtml2pdf both decode
+    # it and re-encode the pixels into the PDF, so a smaller file here would not shrink the report.
+    # Kaleido takes the figure as a plain dict; our charts are already valid, so skip building a validated Figure
+    figure = orjson.loads(chart_json)
+    return _get_kaleido_scope().transform(
+        figure, format="png", width=CHART_WIDTH, height=CHART_HEIGHT, scale=CHART_SCALE
+    )
+
+
+# --- Report template ---
+# Loaded and compiled once per process; the bytecode cache also spares new workers the parse.
+TEMPLATE_DIR = pathlib.Path(__file__).resolve().parent.parent / "templates"
+_env = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache(),
+)
+_template = _env.get_template('report_template.html')
+
+
+class _TemplateStreamReader:
+    """Read-only text file over a Jinja template stream, so the parser pulls HTML as it is rendered."""
+
+    def __init__(self, stream):
+        self._chunks = iter(stream)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buffer + "".join(self._chunks)
+            self._buffer = ""
+            return data
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+if PDF_ENGINE == "weasyprint":
+    class _ChartURLFetcher(URLFetcher):
+        """Serves the in-memory chart images for cid: URLs and fetches everything else as usual."""
+
+        def __init__(self, images: dict, **kwargs):
+            super().__init__(**kwargs)
+            self._images = images
+
+        def fetch(self, url, headers=None):
+            if url.startswith("cid:"):
+                return URLFetcherResponse(url, self._images[url[4:]], {"Content-Type": "image/png"})
+            return super().fetch(url, headers)
+
+
+def _write_pdf(context: dict, images: dict, result):
+    """
+    Renders the report template and converts it into PDF bytes written to `result`.
+    Chart <img> tags point at `cid:<key>` URLs, resolved here to the raw bytes in `images`.
+    """
+    if PDF_ENGINE == "weasyprint":
+        html_out = _template.render(**context)
+        HTML(string=html_out, base_url=str(TEMPLATE_DIR), url_fetcher=_ChartURLFetcher(images)).write_pdf(
+            target=result, font_config=_font_config
+        )
+    else:
+        # xhtml2pdf only resolves links to paths, so the images are written to a scratch directory
+        with tempfile.TemporaryDirectory() as image_dir:
+            image_paths = {}
+            for key, img_bytes in images.items():
+                image_paths[key] = os.path.join(image_dir, f"{key}.png")
+                with open(image_paths[key], "wb") as f:
+                    f.write(img_bytes)
+
+            def link_callback(uri, rel):
+                if uri.startswith("cid:"):
+                    return image_paths[uri[4:]]
+                return uri
+
+            # Stream the rendered HTML into the parser instead of materialising the whole
+            # document as one string first
+            stream = _template.stream(**context)
+            stream.enable_buffering(size=64)
+            pdf = pisa.CreatePDF(
+                src=_TemplateStreamReader(stream),
+                dest=result,
+                link_callback=link_callback
+            )
+
+        if pdf.err:
+            # We can add more detailed logging here if needed
+            print(f"xhtml2pdf error: {pdf.err}")
+            raise Exception("Error generating PDF")
+
+
+# Data-sample table markup, rebuilt once per data version
+_sample_table = {"key": None}
+
+def _get_sample_table_html(df: pd.DataFrame) -> str:
+    """Builds the 10-row preview table directly, with the same markup DataFrame.to_html emits."""
+    key = (data_handler.DATA_VERSION, id(df), len(df))
+    if _sample_table["key"] != key:
+        head = "".join(f"<th>{html.escape(str(column))}</th>" for column in df.columns)
+        rows = "".join(
+            "<tr>" + "".join(f"<td>{html.escape(value)}</td>" for value in row) + "</tr>"
+            for row in df.head(10).astype(str).itertuples(index=False)
+        )
+        _sample_table.update(
+            key=key,
+            html=(
+                '<table border="1" class="dataframe data-table">'
+                f'<thead><tr style="text-align: right;">{head}</tr></thead>'
+                f"<tbody>{rows}</tbody></table>"
+            ),
+        )
+    return _sample_table["html"]
+
+
+async def create_pdf_report(kpis: dict, summary: str, charts: dict, df: pd.DataFrame, sink=None):
+    """
+    Renders an HTML template with data and converts it to a PDF (WeasyPrint, or xhtml2pdf as a fallback).
+    Writes the PDF into `sink` (a binary file object) when given, otherwise returns the bytes.
+    Chart rendering and PDF conversion run off the event loop.
+    """
+    # Convert Plotly JSON charts to static images for the PDF, rendering them in parallel.
+    # The template references them as cid: URLs, so no base64 copy is ever built.
+    loop = asyncio.get_running_loop()
+    rendered = await asyncio.gather(
+        *(loop.run_in_executor(_render_executor, _render_chart_png, chart_json) for chart_json in charts.values())
+    )
+    images = dict(zip(charts.keys(), rendered))
+    img_charts = {key: f"cid:{key}" for key in images}
 
     # Prepare a sample of the data for the PDF
-    data_sample_html = df.head(10).to_html(classes='data-table', index=False)
+    data_sample_html = _get_sample_table_html(df)
     
-    # Render the HTML template with all the data
-    html_out = template.render(
+    # Everything the HTML template needs
+    context = dict(
         kpis=kpis,
         summary=summary,
         charts=img_charts,
@@ -40,16 +212,8 @@ def create_pdf_report(kpis: dict, summary: str, charts: dict, df: pd.DataFrame)
     )
     
     # --- PDF Conversion Logic ---
-    result = io.BytesIO()
-
-    pdf = pisa.CreatePDF(
-        src=io.StringIO(html_out),
-        dest=result
-    )
-    
-    if pdf.err:
-        # We can add more detailed logging here if needed
-        print(f"xhtml2pdf error: {pdf.err}")
-        raise Exception("Error generating PDF")
+    result = sink if sink is not None else io.BytesIO()
+    await asyncio.to_thread(_write_pdf, context, images, result)
 
-    return result.getvalue()
+    if sink is None:
+        return result.getvalue()
@@ -0,0 +1,92 @@
+# Paces Gemini requests to stay under the API's rate limits
+import asyncio
+import random
+import time
+from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+
+# Failures worth retrying: rate limiting (429), overload or network trouble (503/504) and transient server errors (500)
+RETRYABLE_ERRORS = (ResourceExhausted, ServiceUnavailable, DeadlineExceeded, InternalServerError)
+MAX_BACKOFF = 30  # seconds
+
+
+class _TokenBucket:
+    """A bucket holding up to `capacity` units, refilled continuously at `rate` units per second."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if they already are)."""
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+def _retry_after(error: Exception):
+    """Returns the delay the server asked for (RetryInfo detail or Retry-After header), if any."""
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(error, "response", None)
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    try:
+        return float(header) if header is not None else None
+    except ValueError:
+        return None
+
+
+class GeminiLimiter:
+    """
+    Admits calls through a concurrency cap plus requests-per-minute and tokens-per-minute
+    buckets, and retries transient failures (see RETRYABLE_ERRORS) with exponential backoff.
+    """
+
+    def __init__(self, rpm: int, tpm: int, concurrency: int = 4, max_attempts: int = 5):
+        self.max_attempts = max_attempts
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._requests = _TokenBucket(rpm, rpm / 60)
+        self._tokens = _TokenBucket(tpm, tpm / 60)
+        self._lock = asyncio.Lock()
+
+    async def _admit(self, tokens: int):
+        # A single oversized prompt must still be admitted eventually
+        tokens = min(tokens, self._tokens.capacity)
+        async with self._lock:
+            while True:
+                delay = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                if delay == 0:
+                    self._requests.take(1)
+                    self._tokens.take(tokens)
+                    return
+                await asyncio.sleep(delay)
+
+    async def call(self, func, *args, tokens: int = 0, **kwargs):
+        """Awaits `func(*args, **kwargs)` once the limits allow it."""
+        async with self._semaphore:
+            for attempt in range(self.max_attempts):
+                await self._admit(tokens)
+                try:
+                    return await func(*args, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_attempts - 1:
+                        raise
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = min(MAX_BACKOFF, 2 ** attempt) + random.random()
+                    await asyncio.sleep(delay)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), avoiding a count_tokens round trip."""
+    return len(text) // 4 + 1
@@ -0,0 +1,72 @@
+# Similarity-based cache for LLM-generated code
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import diskcache
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Stores (embedding, guard, code) entries per scope and returns the code of the most
+    similar stored question when its cosine similarity clears the threshold.
+    The guard is a set of tokens (e.g. product names, numbers) that must match exactly,
+    so "sales of product a" never answers "sales of product b".
+    """
+
+    def __init__(self, directory: str = None, threshold: float = 0.92, max_entries: int = 512, ttl: float = 24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Entries expire so code cached for older data (or older prompts) doesn't live forever
+        self.ttl = ttl
+        # Scopes are served from memory; diskcache (when a directory is given) only backs them up,
+        # so entries survive restarts and can be shared between worker processes
+        self._entries = {}
+        self._store = diskcache.Cache(directory) if directory else None
+        # Persisting re-pickles a scope's whole embedding matrix, so it runs on a background thread
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-cache") if self._store is not None else None
+        self._lock = threading.Lock()
+
+    def _load(self, scope):
+        """Returns the in-memory entry for a scope, reading it from disk the first time it is seen."""
+        if scope not in self._entries:
+            entry = self._store.get(scope) if self._store is not None else None
+            # Entries written before expiry timestamps existed are ignored
+            self._entries[scope] = entry if entry is not None and "added" in entry else None
+        return self._entries[scope]
+
+    def lookup(self, scope, embedding: np.ndarray, guard: frozenset):
+        """Returns the cached code for the closest matching question in this scope, or None."""
+        entry = self._load(scope)
+        if entry is None:
+            return None
+
+        matrix = entry["embeddings"]
+        similarities = matrix @ embedding / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(embedding) + 1e-12)
+        oldest = time.time() - self.ttl
+        # Best candidates first; the first live one whose guard matches wins
+        for index in np.argsort(similarities)[::-1]:
+            if similarities[index] < self.threshold:
+                break
+            if entry["guards"][index] == guard and entry["added"][index] >= oldest:
+                return entry["codes"][index]
+        return None
+
+    def add(self, scope, embedding: np.ndarray, guard: frozenset, code: str):
+        """Adds an entry, dropping expired ones and evicting the oldest once the scope holds max_entries."""
+        with self._lock:
+            now = time.time()
+            entry = self._load(scope)
+            if entry is None:
+                entry = {"embeddings": np.empty((0, embedding.shape[0])), "guards": [], "codes": [], "added": []}
+            live = [i for i, added in enumerate(entry["added"]) if added >= now - self.ttl]
+            entry = {
+                "embeddings": np.vstack([entry["embeddings"][live], embedding])[-self.max_entries:],
+                "guards": ([entry["guards"][i] for i in live] + [guard])[-self.max_entries:],
+                "codes": ([entry["codes"][i] for i in live] + [code])[-self.max_entries:],
+                "added": ([entry["added"][i] for i in live] + [now])[-self.max_entries:],
+            }
+            self._entries[scope] = entry
+            if self._writer is not None:
+                # The whole scope also expires on disk once nothing has been added to it for a full TTL
+                self._writer.submit(self._store.set, scope, entry, expire=self.ttl)
@@ -115,13 +115,13 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function renderCharts(charts) {
-    Plotly.newPlot('chart1', JSON.parse(charts.sales_by_product), {}, { responsive: true });
-    Plotly.newPlot('chart2', JSON.parse(charts.sales_by_region), {}, { responsive: true });
-    Plotly.newPlot('chart3', JSON.parse(charts.satisfaction_vs_units), {}, { responsive: true });
-    Plotly.newPlot('chart4', JSON.parse(charts.units_by_region_product), {}, { responsive: true });
-    Plotly.newPlot('chart5', JSON.parse(charts.avg_satisfaction_by_product), {}, { responsive: true });
-    Plotly.newPlot('chart6', JSON.parse(charts.sales_vs_units_scatter), {}, { responsive: true });
-    Plotly.newPlot('chart7', JSON.parse(charts.sales_efficiency_heatmap), {}, { responsive: true });
+    Plotly.newPlot('chart1', charts.sales_by_product, {}, { responsive: true });
+    Plotly.newPlot('chart2', charts.sales_by_region, {}, { responsive: true });
+    Plotly.newPlot('chart3', charts.satisfaction_vs_units, {}, { responsive: true });
+    Plotly.newPlot('chart4', charts.units_by_region_product, {}, { responsive: true });
+    Plotly.newPlot('chart5', charts.avg_satisfaction_by_product, {}, { responsive: true });
+    Plotly.newPlot('chart6', charts.sales_vs_units_scatter, {}, { responsive: true });
+    Plotly.newPlot('chart7', charts.sales_efficiency_heatmap, {}, { responsive: true });
     }
 
 